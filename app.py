@@ -3,6 +3,7 @@ import gradio as gr
 import pandas as pd
 import numpy as np
 import sqlite3 
+import os
 
 def create_gradio_dataframe():
     """
@@ -13,10 +14,38 @@ def create_gradio_dataframe():
     回傳：
         dict: 包含 'country_percentage' (全國得票率向量) 及 'cosine_similarity_df' (相似度排序表格)
     """
+    # 選舉結果是固定的 => 若已有快取檔，直接讀取計算好的結果，不必每次啟動都重新計算
+    # 快取檔必須同時比資料庫與 app.py 本身更新 (程式修改後計算方式可能不同，舊的快取就不能再用)
+    cache_paths = ["data/cosine_similarity_df.parquet", "data/country_percentage.npy"]
+    source_mtime = max(os.path.getmtime("data/taiwan_presidential_election_2024.db"), os.path.getmtime(__file__))
+    if all(os.path.exists(path) and os.path.getmtime(path) > source_mtime for path in cache_paths):
+        vector_a = np.load("data/country_percentage.npy")
+        return {
+            "country_percentage": vector_a,
+            "cosine_similarity_df": pd.read_parquet("data/cosine_similarity_df.parquet")
+        }
+
     connection = sqlite3.connect("data/taiwan_presidential_election_2024.db")
-    votes_by_village = pd.read_sql("""SELECT * FROM votes_by_village;""", con=connection)
+    # 直接在 SQLite 以 window function 計算每位候選人在該村里的得票率 (村里得票數 / 村里總票數)
+    # 並依 村里、候選人號碼 排序，方便後續直接 reshape
+    # 只選取計算需要的欄位 (不讀取用不到的 candidate 姓名欄位，減少字串物件的建立)
+    village_percentage_sql = """
+    SELECT county,
+           town,
+           village,
+           id,
+           sum_votes,
+           CAST(sum_votes AS REAL) / SUM(sum_votes) OVER (PARTITION BY county, town, village) AS village_percentage
+      FROM votes_by_village
+     ORDER BY county, town, village, id;
+    """
+    votes_by_village = pd.read_sql(village_percentage_sql, con=connection)
     connection.close()
 
+    # 縣市、鄉鎮、村里名稱重複度高 => 轉為 category，節省記憶體且排序時直接比較整數代碼
+    for column in ["county", "town", "village"]:
+        votes_by_village[column] = votes_by_village[column].astype("category")
+
     # 計算全國總票數
     total_votes = votes_by_village["sum_votes"].sum()
 
@@ -24,51 +53,38 @@ def create_gradio_dataframe():
     country_percentage = votes_by_village.groupby(["id"])["sum_votes"].sum() / total_votes
     vector_a = country_percentage.to_numpy() # 將得票率轉為 numpy array (作為餘弦相似度的比較基準向量)
 
-    # 計算每個村里的總得票數
-    groupby_variables = ["county", "town", "village"]
-    village_total_votes = votes_by_village.groupby(groupby_variables)["sum_votes"].sum()
-
-    # 將 votes_by_village 與 village_total_votes 合併 => 為了計算各村里每位候選人的得票率 (百分比)
-    # 合併後 sum_votes 會變成 sum_votes_x (候選人得票數)，sum_votes_y (村里總票數)
-    merged = pd.merge(votes_by_village, village_total_votes, left_on=groupby_variables, right_on=groupby_variables, how="left")
-    merged["village_percentage"] = merged["sum_votes_x"] / merged["sum_votes_y"]  # 計算每位候選人在該村里的得票率 (村里得票數 / 村里總票數)
-    merged = merged[["county", "town", "village", "id", "village_percentage"]]  # 只保留必要欄位，準備做 pivot 操作
-
-    # 將每位候選人的得票率展開為欄位 (長轉寬)
-    pivot_df = merged.pivot(index=["county", "town", "village"], columns="id", values="village_percentage").reset_index()
-    pivot_df = pivot_df.rename_axis(None, axis=1) # 將 columns 軸的名稱 (原先是 'id') 移除，保持欄位乾淨好讀
+    # 每個村里都剛好有每位候選人各一列，且已依 村里、候選人號碼 排序
+    # => 不需要 pivot，直接將得票率 reshape 成 (村里數, 候選人數) 的矩陣 (長轉寬)
+    number_of_candidates = len(country_percentage)
+    matrix_b = votes_by_village["village_percentage"].to_numpy(dtype=np.float64).reshape(-1, number_of_candidates)  # 各村里候選人得票率，shape 為 (村里數, 3)
+    pivot_df = votes_by_village[["county", "town", "village"]].iloc[::number_of_candidates].reset_index(drop=True)  # 每個村里只取一列作為識別欄位
+    pivot_df[country_percentage.index.to_list()] = matrix_b  # 欄位名稱為候選人號碼 1, 2, 3
 
+    # 計算各村里的餘弦相似度 (各村里 與 全國 的得票率進行 餘弦相似度 計算)
+    # 所有村里都與同一個 vector_a 比較 => 以一次矩陣運算取代逐列迴圈
+    # 先將向量正規化為單位向量 => 餘弦相似度即為單純的內積，不需再做除法
+    unit_vector_a = vector_a / np.sqrt(np.vdot(vector_a, vector_a))  # 全國得票率單位向量 (只需計算一次)
+    unit_matrix_b = matrix_b / np.sqrt(np.einsum("ij,ij->i", matrix_b, matrix_b))[:, None]  # 各村里得票率單位向量
+    cosine_similarities = unit_matrix_b @ unit_vector_a
 
-    # 儲存各村里的餘弦相似度 (各村里 與 全國 的得票率進行 餘弦相似度 計算)
-    cosine_similarities = []  
-    
-    for _, row in pivot_df.iterrows():
-
-        vector_bi = row.iloc[3:].to_numpy()  # 這裡 iloc[3:] 是從第4欄(得票率)開始抓到最後 => EX: [0.22650796491856096 0.4530159298371219 0.3204761052443172]
-                                                                                    #   => 三位候選人得票率         
-        # 計算 cosine similarity
-        vector_a_dot_vector_bi = np.dot(vector_a, vector_bi)
-        length_vector_a = np.linalg.norm(vector_a)  
-        length_vector_bi = np.linalg.norm(vector_bi)
-
-        cosine_similarity = vector_a_dot_vector_bi / (length_vector_a * length_vector_bi)
-        cosine_similarities.append(float(cosine_similarity))  # 將np.float64 轉成一般 float (美觀而已，功能沒影響)
-
-    # 準備將餘弦相似度加入 pivot_df 中
-    cosine_similarity_df = pivot_df.copy()
-    cosine_similarity_df["cosine_similarity"] = cosine_similarities
+    # 將餘弦相似度直接加入 pivot_df 中 (pivot_df 之後不再使用，不需要另外複製一份)
+    pivot_df["cosine_similarity"] = cosine_similarities
+    cosine_similarity_df = pivot_df
 
     # 依照 cosine_similarity 降序排序(為了後續ranking)，相同相似度時依照 縣市、鄉鎮、村里 升序排序
-    cosine_similarity_df = cosine_similarity_df.sort_values(by=["cosine_similarity", "county", "town", "village"], 
-                                                            ascending=[False, True, True, True])
+    # 縣市、鄉鎮、村里為 category (類別依字典序排列) => 直接以整數代碼搭配 np.lexsort 求出排序後的位置，不必比較字串
+    # np.lexsort 以最後一個 key 為主要排序依據；相似度取負號即為降序
+    sorted_positions = np.lexsort((cosine_similarity_df["village"].cat.codes.to_numpy(),
+                                   cosine_similarity_df["town"].cat.codes.to_numpy(),
+                                   cosine_similarity_df["county"].cat.codes.to_numpy(),
+                                   -cosine_similarities))
+    cosine_similarity_df = cosine_similarity_df.iloc[sorted_positions].reset_index(drop=True)
 
-    # 重設 index，並加上 similarity_rank 欄位 (從 1 開始編號)
-    cosine_similarity_df = cosine_similarity_df.reset_index(drop=True).reset_index()
-    cosine_similarity_df["index"] = cosine_similarity_df["index"] + 1
+    # 加上 similarity_rank 欄位 (從 1 開始編號)
+    cosine_similarity_df.insert(0, "similarity_rank", np.arange(1, len(cosine_similarity_df) + 1))
 
     # 重新命名欄位名稱，使表格語意清晰
     column_names_to_revise = {
-        "index": "similarity_rank",   # 排名
         1: "candidates_1",            # 第一位候選人的得票率欄位
         2: "candidates_2",            # 第二位候選人的得票率欄位
         3: "candidates_3"             # 第三位候選人的得票率欄位
@@ -76,6 +92,13 @@ def create_gradio_dataframe():
 
     cosine_similarity_df = cosine_similarity_df.rename(columns=column_names_to_revise)
 
+    # 將計算結果寫入快取檔，下次啟動時直接讀取
+    try:
+        np.save("data/country_percentage.npy", vector_a)
+        cosine_similarity_df.to_parquet("data/cosine_similarity_df.parquet", index=False)
+    except OSError:
+        pass  # data 資料夾無法寫入 (例如唯讀的部署環境) => 不使用快取，每次啟動重新計算即可
+
     # 回傳全國得票率向量 與 計算後的餘弦相似度 DataFrame
     return {
         "country_percentage": vector_a,  # 全國得票率向量
@@ -1,8 +1,12 @@
 
 import pandas as pd
+import numpy as np
 import os
 import re
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from openpyxl import load_workbook
 
 
 class CreateTaiwanPresidentialElection2024DB:
@@ -40,13 +44,16 @@ class CreateTaiwanPresidentialElection2024DB:
         - 回傳處理後的 DataFrame。
         """
         file_path = f"data/總統-A05-4-候選人得票數一覽表-各投開票所({county_name}).xlsx"
-        df = pd.read_excel(file_path, skiprows=[0, 3, 4])  # 讀取並跳過多餘標題列
-        df = df.iloc[:, :6]  # 只保留前六欄 (鄉鎮、市里、投開票所與三位候選人資訊)
+        # 以 read_only 模式串流讀取 (不載入樣式、格式)，只保留前六欄 (鄉鎮、市里、投開票所與三位候選人資訊)
+        with closing(load_workbook(file_path, read_only=True, data_only=True)) as workbook:  # 讀取失敗時也會關閉檔案
+            rows = [row[:6] for i, row in enumerate(workbook.active.iter_rows(values_only=True)) if i not in {0, 3, 4}]  # 跳過多餘標題列
+        df = pd.DataFrame(rows[1:], columns=rows[0]).replace("", np.nan)  # 空白儲存格視為缺失值 (與 pd.read_excel 行為一致)
         candidates_info = df.iloc[0, 3:].to_list()  # 抓取第一行的候選人資訊
         df.columns = ["town", "village", "polling_place"] + candidates_info  # 設定新欄位名稱
         df["town"] = df["town"].ffill().str.strip() # 鄉鎮名稱若有缺漏則向下填補，並去除名稱前後空白
         df = df.dropna()  # 移除任何有缺失值的列 (避免空白列影響資料處理)
         df["polling_place"] = df["polling_place"].astype(int)  # 投開票所編號轉為整數
+        df[candidates_info] = df[candidates_info].astype(int)  # 票數在 Excel 中以浮點數儲存 => 轉為整數
         id_variables = ["town", "village", "polling_place"]  # 不需要展開的識別欄位 
         melted_df = pd.melt(df, id_vars=id_variables, var_name="candidate_info", value_name="votes") # 將候選人票數展平成長格式
         melted_df["county"] = county_name  # 新增縣市欄位以利辨識
@@ -60,23 +67,17 @@ class CreateTaiwanPresidentialElection2024DB:
         - 統一欄位名稱格式。
         - 回傳總表 DataFrame。
         """
-        country_df = pd.DataFrame()
-        for county_name in self.county_names:
-            county_df = self.tidy_county_dataframe(county_name)  # 處理該縣市的相關資訊
-            country_df = pd.concat([country_df, county_df])  # 合併進總表
+        # 各縣市的 Excel 檔彼此獨立 => 以多個行程平行讀取與整理，最後只合併一次 (避免迴圈內反覆 concat 造成重複複製)
+        with ProcessPoolExecutor() as executor:
+            county_dfs = list(executor.map(self.tidy_county_dataframe, self.county_names))  # map 會保持縣市原本的順序
 
-        country_df = country_df.reset_index(drop=True) # 重設索引
-
-        numbers = []  # 候選人號碼清單
-        candidates = [] # 候選人姓名清單
+        country_df = pd.concat(county_dfs, ignore_index=True)  # 合併成總表並重設索引
 
         # 解析 candidate_info 欄位 (格式EX：(1)\n柯文哲\n吳欣盈)
-        for elem in country_df["candidate_info"]:
-            parts = elem.strip().split("\n")   # 以換行符號拆開
-            number = int(parts[0].strip("()"))  # 取號碼並去掉括號
-            candidate = f"{parts[1]}/{parts[2]}"   # 將正副手姓名以 '/' 連接
-            numbers.append(number)
-            candidates.append(candidate)
+        # 以向量化的正則表達式一次拆出 號碼、正手姓名、副手姓名 三個欄位
+        candidate_parts = country_df["candidate_info"].str.strip().str.extract(r"\((\d+)\)\n(.+?)\n(.+)")
+        numbers = candidate_parts[0].astype(int)  # 候選人號碼
+        candidates = candidate_parts[1] + "/" + candidate_parts[2]  # 將正副手姓名以 '/' 連接
 
         # 建立投票明細 DataFrame
         presidential_votes =  country_df.loc[:, ["county", "town", "village", "polling_place"]]
@@ -96,17 +97,24 @@ class CreateTaiwanPresidentialElection2024DB:
         """
         presidential_votes = self.concat_country_dataframe()  # 整理全國票數明細
 
+        # 縣市、鄉鎮、村里名稱重複度高 => 轉為 category，後續 groupby / merge 直接比較整數代碼
+        for column in ["county", "town", "village"]:
+            presidential_votes[column] = presidential_votes[column].astype("category")
+
         # 產生投票所表 polling_places_df
-        polling_places_df = presidential_votes.groupby(["county", "town", "village", "polling_place"]).count().reset_index()
-        polling_places_df = polling_places_df[["county", "town", "village", "polling_place"]]  # 移除多餘欄位
-        polling_places_df = polling_places_df.reset_index()  # 用 index 產生新的 id
-        polling_places_df["index"] = polling_places_df["index"] + 1  # 從 1 開始編號
-        polling_places_df = polling_places_df.rename(columns={"index": "id"})   # 將 index 改為 id
+        # 直接取不重複的投票所，並依 縣市、鄉鎮、村里、投票所編號 排序 (與原本 groupby 的順序一致)
+        polling_places_df = (presidential_votes[["county", "town", "village", "polling_place"]]
+                             .drop_duplicates()
+                             .sort_values(["county", "town", "village", "polling_place"])
+                             .reset_index(drop=True))
+        polling_places_df.insert(0, "id", np.arange(1, len(polling_places_df) + 1))  # 從 1 開始編號作為 id
 
         # 產生候選人表 candidates_df
-        candidates_df = presidential_votes.groupby(["number", "candidate"]).count().reset_index()
-        candidates_df = candidates_df[["number", "candidate"]]  # 只保留號碼與姓名
-        candidates_df = candidates_df.rename(columns={"number": "id"}) # 因為 number 已經是1、2、3了 => 將號碼直接設為 id
+        candidates_df = (presidential_votes[["number", "candidate"]]
+                         .drop_duplicates()
+                         .sort_values("number")
+                         .rename(columns={"number": "id"})  # 因為 number 已經是1、2、3了 => 將號碼直接設為 id
+                         .reset_index(drop=True))
 
         # 產生投票明細表 votes_df
         join_keys = ["county", "town", "village", "polling_place"]  # 連接用的主鍵
@@ -123,11 +131,24 @@ class CreateTaiwanPresidentialElection2024DB:
 
         # 寫入 SQLite 資料庫
         connection = sqlite3.connect("data/taiwan_presidential_election_2024.db")
+        connection.execute("PRAGMA journal_mode=MEMORY;")  # 日誌檔放在記憶體，減少磁碟寫入
+        connection.execute("PRAGMA synchronous=OFF;")  # 不等待每次寫入 fsync (資料庫可隨時由 Excel 重建)
         for k, v in election_info.items():
-            v.to_sql(name=k, con=connection, index=False, if_exists="replace")
+            # method="multi": 每個 INSERT 一次寫入多列 (每批 1000 列)，減少逐列執行 INSERT 的次數
+            v.to_sql(name=k, con=connection, index=False, if_exists="replace", method="multi", chunksize=1000)
 
-        # 建立檢視表 votes_by_village (村里統計)
         cur = connection.cursor()
+
+        # 在 votes_by_village JOIN 的維度表主鍵上建立索引 (votes 本身仍需全表掃描，不需另建索引)
+        create_index_sqls = [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_pp_id ON polling_places(id);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_cand_id ON candidates(id);",
+            "ANALYZE;"  # 更新統計資訊，供查詢規劃器選擇索引
+        ]
+        for create_index_sql in create_index_sqls:
+            cur.execute(create_index_sql)
+
+        # 建立檢視表 votes_by_village (村里統計)
         drop_view_sql = """
         DROP VIEW IF EXISTS votes_by_village;
         """